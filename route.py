@@ -4,75 +4,159 @@
 # - 지사 기준점/주요 지점 표시는 "항상 고정"으로 hline 위에 표시(이정 로직 영향 없음)
 
 import os
+import re
+from collections import namedtuple
 from io import BytesIO
 
+import numpy as np
 import pandas as pd
 import streamlit as st
+
+import matplotlib
+
+# 서버 렌더 전용 — pyplot import 전에 Agg 고정(인터랙티브 백엔드 초기화/GUI 상태 회피)
+matplotlib.use("Agg")
+
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
 from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.collections import LineCollection
 
 
 # ======================================================
 # 1) 폰트(있으면 적용)
 # ======================================================
 FONT_PATH = "fonts/NanumGothic-Regular.ttf"
-if os.path.exists(FONT_PATH):
+
+
+# addfont/TTF 이름 파싱은 서버 프로세스당 1회면 충분 — rerun마다 TTF를 다시 열지 않게 캐시
+@st.cache_resource(show_spinner=False)
+def setup_korean_font():
+    if not os.path.exists(FONT_PATH):
+        return None
     fm.fontManager.addfont(FONT_PATH)
-    plt.rcParams["font.family"] = fm.FontProperties(fname=FONT_PATH).get_name()
+    font_name = fm.FontProperties(fname=FONT_PATH).get_name()
+    plt.rcParams["font.family"] = font_name
+    # 한글 라벨 다수 렌더 시 freetype 힌팅/경로 단순화 비용 절감
+    plt.rcParams.update(
+        {
+            "text.hinting": "none",
+            "path.simplify": True,
+            "path.simplify_threshold": 1.0,
+        }
+    )
+    return font_name
 
 
 # ======================================================
 # 2) 데이터 로드
 # ======================================================
-@st.cache_data
-def load_data():
-    return pd.read_csv("data.csv")
-
-
-df = load_data()
+DATA_CSV = "data.csv"
+DATA_CACHE = "data.cache.parquet"
 
 NAME_COL = "name"
 KM_COL = "이정(km)"
 TYPE_COL = "종별구분"
 
-# ✅ 이정 숫자화(정렬/그룹핑 안정)
-df[KM_COL] = pd.to_numeric(df[KM_COL], errors="coerce")
-
-# 표시용 이름(괄호 제거)
-df["표시이름"] = (
-    df[NAME_COL]
-    .astype(str)
-    .str.replace(r"\(영암\)", "", regex=True)
-    .str.replace(r"\(순천\)", "", regex=True)
-    .str.strip()
+# 표시이름에서 떼어낼 방향 꼬리표 — 모듈에서 1회 컴파일, 한 번의 치환 패스로 처리
+_DIR_TAG_RE = re.compile(r"\((?:영암|순천)\)")
+
+
+# df + 파생 상태(방향 마스크/선택지 목록)를 한 번에 캐시
+DataBundle = namedtuple(
+    "DataBundle",
+    [
+        "df",
+        "has_yeongam",
+        "has_suncheon",
+        "neutral",
+        "yeongam_options",
+        "suncheon_options",
+        "ic_km",
+        "up_base",
+        "down_base",
+    ],
 )
 
 
-# ======================================================
-# 3) 방향 분류
-# ======================================================
-has_yeongam = df[NAME_COL].astype(str).str.contains("영암", na=False)
-has_suncheon = df[NAME_COL].astype(str).str.contains("순천", na=False)
-neutral = ~(has_yeongam | has_suncheon)
+# cache_resource: 반환 객체를 rerun마다 다시 해시하지 않고 동일 객체로 재사용
+# (파생 컬럼/마스크까지 만들어 두므로, 이후 코드는 df를 수정하지 말 것)
+@st.cache_resource
+def load_data():
+    # CSV 파싱이 콜드스타트 비용의 대부분 → 최초 1회만 파싱해서 Parquet으로 캐시
+    # (data.csv가 갱신되면 mtime 비교로 캐시 재생성)
+    if os.path.exists(DATA_CACHE) and os.path.getmtime(DATA_CACHE) >= os.path.getmtime(DATA_CSV):
+        df = pd.read_parquet(DATA_CACHE)
+    else:
+        # usecols+명시 dtype → 타입 추론/불필요 컬럼 파싱 생략, pyarrow 엔진은 병렬 파싱
+        df = pd.read_csv(
+            DATA_CSV,
+            usecols=[NAME_COL, KM_COL, TYPE_COL],
+            dtype={NAME_COL: "string", TYPE_COL: "string"},
+            engine="pyarrow",
+        )
+        df.to_parquet(DATA_CACHE)
 
-yeongam_options = df[has_yeongam | neutral][NAME_COL].dropna().unique().tolist()
-suncheon_options = df[has_suncheon | neutral][NAME_COL].dropna().unique().tolist()
+    # ✅ 이정 숫자화(정렬/그룹핑 안정) — rerun마다 재계산하지 않도록 캐시 안에서 1회
+    # downcast: 이정은 소수 둘째 자리까지라 float32면 충분 → 캐시 상주 메모리 절반
+    df[KM_COL] = pd.to_numeric(df[KM_COL], errors="coerce", downcast="float")
 
+    # 전역을 km 오름차순으로 1회 정렬(NaN 마지막) — 이후 마스크/선택 필터링은
+    # 순서를 보존하므로 assign_numbers에서 재정렬이 필요 없어진다
+    df = df.sort_values(KM_COL, kind="mergesort", na_position="last", ignore_index=True)
 
-# ======================================================
-# 4) UI
-# ======================================================
-st.title("거리비례 노선도 생성기")
+    # 교량명은 category로 — 이후 .isin(선택목록) 필터가 문자열 비교 대신 코드 비교로 동작
+    df[NAME_COL] = df[NAME_COL].astype("category")
+    # 종별구분은 저카디널리티 → category로 캐스팅해 IC 탐지를 카테고리 목록에서만 수행
+    df[TYPE_COL] = df[TYPE_COL].astype("category")
 
-st.sidebar.header("교량 선택")
-selected_yeongam = st.sidebar.multiselect("영암 방향 표시할 교량", yeongam_options)
-selected_suncheon = st.sidebar.multiselect("순천 방향 표시할 교량", suncheon_options)
+    # 표시용 이름(괄호 제거) — 치환 2패스 대신 컴파일된 교대 패턴 1패스
+    df["표시이름"] = (
+        df[NAME_COL].astype(str).str.replace(_DIR_TAG_RE, "", regex=True).str.strip()
+    )
+
+    # 방향 분류 마스크/선택지도 CSV에만 의존 → 같은 캐시 안에서 1회 계산
+    # str.contains(정규식) 3패스 대신 str.find 기반 단일 분류 → 방향 categorical 1개
+    name_str = df[NAME_COL].astype(str)
+    has_yeongam = name_str.str.find("영암").to_numpy() >= 0
+    has_suncheon = name_str.str.find("순천").to_numpy() >= 0
+    neutral = ~(has_yeongam | has_suncheon)
+    df["방향"] = pd.Categorical(
+        np.select([has_yeongam, has_suncheon], ["영암", "순천"], default="중립")
+    )
 
-st.sidebar.divider()
+    # 선택지는 불변 튜플로 — 위젯/캐시 쪽에서 매 rerun 해시·복사가 싸진다
+    # 행 복사(불리언 인덱싱) 없이 ndarray 슬라이스에 바로 pd.unique
+    names_arr = df[NAME_COL].to_numpy()
+    name_ok = pd.notna(names_arr)
+    yeongam_options = tuple(pd.unique(names_arr[(has_yeongam | neutral) & name_ok]))
+    suncheon_options = tuple(pd.unique(names_arr[(has_suncheon | neutral) & name_ok]))
+
+    # IC 자동 감지 — 전체 컬럼 문자열 스캔 대신 카테고리 목록(O(카테고리 수))에서 판별
+    ic_cats = [c for c in df[TYPE_COL].cat.categories if "IC" in str(c)]
+    ic_km = None
+    if ic_cats:
+        ic_mask = df[TYPE_COL].isin(ic_cats).to_numpy()
+        first_km = df[KM_COL].to_numpy(dtype=float)[int(np.argmax(ic_mask))]
+        if not np.isnan(first_km):
+            ic_km = float(first_km)
+
+    # 무선택(전체) 프레임은 정렬·번호 부여까지 캐시 안에서 끝내 둔다 — rerun 시 재정렬 없음
+    up_base = assign_numbers(df[has_yeongam | neutral], ascending=False)
+    down_base = assign_numbers(df[has_suncheon | neutral], ascending=True)
+
+    return DataBundle(
+        df,
+        has_yeongam,
+        has_suncheon,
+        neutral,
+        yeongam_options,
+        suncheon_options,
+        ic_km,
+        up_base,
+        down_base,
+    )
 
-# ✅ 가까운 교량 묶는 기준(0.01k대면 0.03~0.05 추천)
-group_threshold_km = st.sidebar.number_input("가까운 교량 묶음 기준(km)", value=0.03, step=0.01)
 
 # ✅ 지사 기준/주요 지점은 "항상 고정 표시"
 FIXED_POINTS = [
@@ -90,26 +174,53 @@ FIXED_POINTS = [
 # ======================================================
 # 5) 선택 반영 + 번호 부여
 # ======================================================
-df_up_base = df[has_yeongam | neutral]
-df_down_base = df[has_suncheon | neutral]
-
-df_up = df[df[NAME_COL].isin(selected_yeongam)] if selected_yeongam else df_up_base
-df_down = df[df[NAME_COL].isin(selected_suncheon)] if selected_suncheon else df_down_base
+# 그리기 쪽이 쓰는 건 컬럼 배열뿐 — DataFrame 대신 ndarray 묶음(SoA)으로 전달
+DirectionData = namedtuple("DirectionData", ["kms", "names", "nums", "disp"])
+
+
+def assign_numbers(src_df, ascending):
+    # 전제: 로더에서 km 오름차순(NaN 마지막)으로 전역 정렬했고 마스크 필터는 순서를
+    # 보존하므로, 여기서는 정렬 없이 방향만 맞춘다(내림차순은 유효 구간만 뒤집기)
+    kms = src_df[KM_COL].to_numpy(dtype=float)
+    order = np.arange(kms.size)
+    if not ascending:
+        # NaN은 정렬 방향과 무관하게 끝으로 (sort_values의 na_position="last"와 동일)
+        n_valid = kms.size - int(np.isnan(kms).sum())
+        order = np.concatenate([order[:n_valid][::-1], order[n_valid:]])
+
+    nums = np.arange(1, kms.size + 1)
+    # 단독 그룹 라벨용 "(n)" 문자열 — 행별 f-string 대신 np.char 일괄 결합
+    disp = np.char.add(np.char.add("(", nums.astype(str)), ")")
+    return DirectionData(
+        kms[order],
+        src_df["표시이름"].to_numpy(dtype=str)[order],
+        nums,
+        disp,
+    )
 
-# 영암: 큰 km -> 작은 km
-df_up_sorted = df_up.sort_values(KM_COL, ascending=False).reset_index(drop=True)
-df_up_sorted["번호"] = df_up_sorted.index + 1
 
-# 순천: 작은 km -> 큰 km
-df_down_sorted = df_down.sort_values(KM_COL, ascending=True).reset_index(drop=True)
-df_down_sorted["번호"] = df_down_sorted.index + 1
+def build_sorted_frames(selected_yeongam, selected_suncheon):
+    # 데이터/마스크는 캐시된 번들에서 — load_data()는 cache_resource 히트라 사실상 공짜
+    b = load_data()
+    df = b.df
 
+    # 선택 필터는 category 코드 배열(np.isin, int 비교)로 — 문자열 해시 isin보다 가볍다
+    # 방향 마스크와 결합해 해당 방향 선택지 밖의 동명 행이 섞이지 않게 한다
+    def select(names, base_mask):
+        sel_codes = df[NAME_COL].cat.categories.get_indexer(list(names))
+        return df[base_mask & np.isin(df[NAME_COL].cat.codes.to_numpy(), sel_codes)]
 
-# ======================================================
-# 6) (선택) IC 자동 감지(있으면 표시) - 기존 흐름 유지용
-# ======================================================
-ic_rows = df[df[TYPE_COL].astype(str).str.contains("IC", na=False)]
-ic_km = float(ic_rows.iloc[0][KM_COL]) if (not ic_rows.empty and pd.notna(ic_rows.iloc[0][KM_COL])) else None
+    # 무선택이면 번들에 미리 정렬·번호 부여해 둔 기본 프레임을 그대로 반환
+    # 영암: 큰 km -> 작은 km / 순천: 작은 km -> 큰 km
+    if selected_yeongam:
+        up = assign_numbers(select(selected_yeongam, b.has_yeongam | b.neutral), ascending=False)
+    else:
+        up = b.up_base
+    if selected_suncheon:
+        down = assign_numbers(select(selected_suncheon, b.has_suncheon | b.neutral), ascending=True)
+    else:
+        down = b.down_base
+    return up, down
 
 
 # ======================================================
@@ -118,38 +229,32 @@ ic_km = float(ic_rows.iloc[0][KM_COL]) if (not ic_rows.empty and pd.notna(ic_row
 #    - 라벨은 패턴 오프셋(무한 증가 X) + leader line
 #    - 지사 기준/주요 지점은 hline 위에 고정 표시(+0.4)
 # ======================================================
-def draw_route(up_df, down_df, ic_km=None, group_threshold_km=0.03, fixed_points=None):
-    fig, ax = plt.subplots(figsize=(22, 10))
-
-    MIN_KM = 0.0
-    MAX_KM = 106.8
-
-    # 선 위치
-    y_up = 1.0
-    y_down = 0.0
-
-    # 끝단 여유(라벨이 밖으로 튀지 않게)
-    EDGE_MARGIN_KM = 1.5
-
-    # ✅ 라벨 오프셋은 "고정 패턴"으로 반복(거미줄 방지)
-    X_OFFSETS = [-0.8, 0.8, -1.6, 1.6, -2.4, 2.4]
-    UP_Y_LEVELS =   [y_up + 0.12, y_up - 0.10, y_up + 0.04, y_up - 0.18, y_up + 0.20, y_up - 0.28]
-    DOWN_Y_LEVELS = [y_down + 0.12, y_down - 0.10, y_down + 0.20, y_down - 0.18, y_down + 0.28, y_down - 0.26]
-
-    def clamp_x(x):
-        return min(max(x, MIN_KM + 0.05), MAX_KM - 0.05)
+# 노선도 좌표계(고정) — 배경 래스터와 동적 요소가 공유
+MIN_KM = 0.0
+MAX_KM = 106.8
+Y_UP = 1.0
+Y_DOWN = 0.0
+Y_MIN, Y_MAX = -1.0, 2.0
+
+
+@st.cache_resource(show_spinner=False)
+def route_background(fixed_points: tuple):
+    """선택과 무관한 고정 요소(기준선/방향 표기/고정 지점)를 1회 렌더한 배경 래스터."""
+    fig = plt.figure(figsize=(22, 10))
+    # 축이 Figure 전체를 채워야 imshow extent와 데이터 좌표가 1:1로 맞는다
+    ax = fig.add_axes([0.0, 0.0, 1.0, 1.0])
+    ax.set_xlim(MIN_KM, MAX_KM)
+    ax.set_ylim(Y_MIN, Y_MAX)
+    ax.axis("off")
 
     # ---------------- 라인(기본) ----------------
-    ax.hlines(y_up, MIN_KM, MAX_KM, colors="black", linewidth=2)
-    ax.text(MIN_KM, y_up + 0.6, "영암 방향 (106.8k → 0k)", fontsize=14)
+    ax.hlines(Y_UP, MIN_KM, MAX_KM, colors="black", linewidth=2)
+    ax.text(MIN_KM, Y_UP + 0.6, "영암 방향 (106.8k → 0k)", fontsize=14)
 
-    ax.hlines(y_down, MIN_KM, MAX_KM, colors="black", linewidth=2)
-    ax.text(MIN_KM, y_down + 0.6, "순천 방향 (0k → 106.8k)", fontsize=14)
+    ax.hlines(Y_DOWN, MIN_KM, MAX_KM, colors="black", linewidth=2)
+    ax.text(MIN_KM, Y_DOWN + 0.6, "순천 방향 (0k → 106.8k)", fontsize=14)
 
     # ---------------- 고정 지점 표시(세로선: 위~아래 관통 + 라벨은 위로 0.4) ----------------
-    if fixed_points is None:
-        fixed_points = []
-
     TEXT_DY = 0.40  # 라벨 위치를 0.4 올림
 
     for name, km in fixed_points:
@@ -160,17 +265,17 @@ def draw_route(up_df, down_df, ic_km=None, group_threshold_km=0.03, fixed_points
         lw = 2.2 if name == "지사 기준" else 1.2  # 지사 기준만 조금 굵게(원하면 삭제 가능)
         ax.vlines(
             km,
-            y_down - 0.35,
-            y_up + 0.35,
+            Y_DOWN - 0.35,
+            Y_UP + 0.35,
             colors="black",
             linewidth=lw,
             zorder=9
         )
 
-        # 라벨은 위쪽 라인 기준으로 +0.4
+        # 라벨은 위쪽 라인 기준으로 +0.4 (끝단 라벨은 래스터 밖으로 잘리지 않게 안쪽으로)
         ax.text(
-            km,
-            y_up + TEXT_DY,
+            min(max(km, MIN_KM + 1.8), MAX_KM - 1.8),
+            Y_UP + TEXT_DY,
             f"{name} {km:.1f}",
             ha="center",
             va="bottom",
@@ -178,128 +283,134 @@ def draw_route(up_df, down_df, ic_km=None, group_threshold_km=0.03, fixed_points
             zorder=10,
             bbox=dict(boxstyle="round,pad=0.20", fc="white", ec="black", lw=1),
         )
-    # ---------------- 그룹핑 유틸 ----------------
-    def iter_groups(sorted_df, threshold_km):
-        prev_km = None
-        group = []
-        for idx, row in sorted_df.iterrows():
-            km = row[KM_COL]
-            if pd.isna(km):
-                continue
-
-            if prev_km is None:
-                group = [(idx, row)]
-            else:
-                if abs(float(prev_km) - float(km)) <= float(threshold_km):
-                    group.append((idx, row))
-                else:
-                    yield group
-                    group = [(idx, row)]
-            prev_km = km
-
-        if group:
-            yield group
-
-    # ---------------- 영암(위) ----------------
-    up_sorted = up_df.sort_values(KM_COL, ascending=False).reset_index(drop=True)
-
-    for g_idx, g in enumerate(iter_groups(up_sorted, group_threshold_km)):
-        kms = [float(r[KM_COL]) for _, r in g if pd.notna(r[KM_COL])]
-        if not kms:
-            continue
-
-        # 마커는 각 교량 위치에 그대로
-        for km in kms:
-            ax.scatter(km, y_up, marker="v", s=220, color="black")
-
-        nums = [int(r["번호"]) for _, r in g]
-        n1, n2 = min(nums), max(nums)
-        label = f"({n1}~{n2})" if n1 != n2 else f"({n1})"
-
-        km_anchor = sum(kms) / len(kms)
-
-        x_offset = X_OFFSETS[g_idx % len(X_OFFSETS)]
-        y_text = UP_Y_LEVELS[g_idx % len(UP_Y_LEVELS)]
 
-        if km_anchor < MIN_KM + EDGE_MARGIN_KM:
-            x_text = km_anchor + abs(x_offset)
-        elif km_anchor > MAX_KM - EDGE_MARGIN_KM:
-            x_text = km_anchor - abs(x_offset)
-        else:
-            x_text = km_anchor + x_offset
+    buf = BytesIO()
+    fig.savefig(buf, format="png", dpi=200, transparent=True)
+    plt.close(fig)
+    buf.seek(0)
+    return plt.imread(buf)
 
-        x_text = clamp_x(x_text)
 
-        ax.plot([km_anchor, x_text], [y_up, y_text], linewidth=0.7, color="black")
-        ax.text(
-            x_text,
-            y_text,
-            label,
-            rotation=90,
-            ha="center",
-            va="center",
-            fontsize=11,
-        )
+def draw_route(up, down, ic_km=None, group_threshold_km=0.03, fixed_points=None):
+    # 고정 레이아웃: tight_layout/bbox_inches="tight"의 전체 아티스트 재측정 패스를 생략
+    fig = plt.figure(figsize=(22, 10))
+    ax = fig.add_axes([0.02, 0.05, 0.96, 0.90])
 
-    # ---------------- 순천(아래) ----------------
-    down_sorted = down_df.sort_values(KM_COL, ascending=True).reset_index(drop=True)
+    # 선 위치
+    y_up = Y_UP
+    y_down = Y_DOWN
 
-    for g_idx, g in enumerate(iter_groups(down_sorted, group_threshold_km)):
-        kms = [float(r[KM_COL]) for _, r in g if pd.notna(r[KM_COL])]
-        if not kms:
-            continue
+    # 끝단 여유(라벨이 밖으로 튀지 않게)
+    EDGE_MARGIN_KM = 1.5
 
-        for km in kms:
-            ax.scatter(km, y_down, marker="^", s=220, color="black")
+    # ✅ 라벨 오프셋은 "고정 패턴"으로 반복(거미줄 방지)
+    X_OFFSETS = [-0.8, 0.8, -1.6, 1.6, -2.4, 2.4]
+    UP_Y_LEVELS =   [y_up + 0.12, y_up - 0.10, y_up + 0.04, y_up - 0.18, y_up + 0.20, y_up - 0.28]
+    DOWN_Y_LEVELS = [y_down + 0.12, y_down - 0.10, y_down + 0.20, y_down - 0.18, y_down + 0.28, y_down - 0.26]
 
-        nums = [int(r["번호"]) for _, r in g]
-        n1, n2 = min(nums), max(nums)
-        label = f"({n1}~{n2})" if n1 != n2 else f"({n1})"
+    # 라벨용 FontProperties는 1회 생성 후 공유 — 텍스트 아티스트마다 폰트 탐색/복사 생략
+    label_fp = fm.FontProperties(size=11)
 
-        km_anchor = sum(kms) / len(kms)
+    # ---------------- 배경(기준선/방향 표기/고정 지점) — 캐시된 래스터를 깔기 ----------------
+    if fixed_points is None:
+        fixed_points = []
 
-        x_offset = X_OFFSETS[g_idx % len(X_OFFSETS)]
-        y_text = DOWN_Y_LEVELS[g_idx % len(DOWN_Y_LEVELS)]
+    ax.imshow(
+        route_background(tuple(fixed_points)),
+        extent=(MIN_KM, MAX_KM, Y_MIN, Y_MAX),
+        aspect="auto",
+        zorder=0,
+        interpolation="bilinear",
+    )
 
-        if km_anchor < MIN_KM + EDGE_MARGIN_KM:
-            x_text = km_anchor + abs(x_offset)
-        elif km_anchor > MAX_KM - EDGE_MARGIN_KM:
-            x_text = km_anchor - abs(x_offset)
-        else:
-            x_text = km_anchor + x_offset
+    # ---------------- 방향별 공통 그리기 ----------------
+    def draw_direction(src, y_line, marker, y_levels):
+        # src는 DirectionData(ndarray 묶음) — 방향별 km 순서(NaN 마지막)로 이미 정렬됨
+        valid = ~np.isnan(src.kms)
+        kms = src.kms[valid]
+        nums = src.nums[valid]
+        disp = src.disp[valid]
+        if kms.size == 0:
+            return
+
+        # 마커는 방향당 한 번의 scatter로 일괄 렌더.
+        # PDF 저장 시 마커만 래스터화해 벡터 경로 수를 줄인다(텍스트는 벡터 유지).
+        sc = ax.scatter(kms, np.full_like(kms, y_line), marker=marker, s=220, color="black")
+        sc.set_rasterized(True)
+
+        # 그룹 경계(np.diff 1패스) → 앵커/오프셋/라벨 y까지 전부 벡터 연산.
+        # 파이썬 루프에는 matplotlib 호출만 남긴다.
+        boundaries = np.flatnonzero(np.abs(np.diff(kms)) > float(group_threshold_km)) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [kms.size]))
+
+        anchors = np.add.reduceat(kms, starts) / (ends - starts)
+
+        g_idx = np.arange(starts.size)
+        x_off = np.asarray(X_OFFSETS)[g_idx % len(X_OFFSETS)]
+        y_texts = np.asarray(y_levels)[g_idx % len(y_levels)]
+
+        x_texts = np.where(
+            anchors < MIN_KM + EDGE_MARGIN_KM,
+            anchors + np.abs(x_off),
+            np.where(anchors > MAX_KM - EDGE_MARGIN_KM, anchors - np.abs(x_off), anchors + x_off),
+        )
+        x_texts = np.clip(x_texts, MIN_KM + 0.05, MAX_KM - 0.05)
+
+        # 번호는 정렬순으로 단조 → 그룹 min/max는 경계 원소로 충분
+        n1s = np.minimum(nums[starts], nums[ends - 1]).astype(int)
+        n2s = np.maximum(nums[starts], nums[ends - 1]).astype(int)
+
+        # 지시선은 그룹당 plot 호출 대신 (G, 2, 2) 세그먼트 배열로 묶어 컬렉션 1개로 렌더
+        segs = np.empty((starts.size, 2, 2))
+        segs[:, 0, 0] = anchors
+        segs[:, 0, 1] = y_line
+        segs[:, 1, 0] = x_texts
+        segs[:, 1, 1] = y_texts
+        ax.add_collection(LineCollection(segs, colors="black", linewidths=0.7))
+
+        for i in g_idx:
+            label = f"({n1s[i]}~{n2s[i]})" if n1s[i] != n2s[i] else disp[starts[i]]
+
+            ax.text(
+                x_texts[i],
+                y_texts[i],
+                label,
+                rotation=90,
+                ha="center",
+                va="center",
+                fontproperties=label_fp,
+            )
 
-        x_text = clamp_x(x_text)
+    # ---------------- 영암(위) ----------------
+    draw_direction(up, y_line=y_up, marker="v", y_levels=UP_Y_LEVELS)
 
-        ax.plot([km_anchor, x_text], [y_down, y_text], linewidth=0.7, color="black")
-        ax.text(
-            x_text,
-            y_text,
-            label,
-            rotation=90,
-            ha="center",
-            va="center",
-            fontsize=11,
-        )
+    # ---------------- 순천(아래) ----------------
+    draw_direction(down, y_line=y_down, marker="^", y_levels=DOWN_Y_LEVELS)
 
     # ---------------- (선택) IC 표시(기존 유지용) ----------------
     if ic_km is not None and MIN_KM <= float(ic_km) <= MAX_KM:
         ik = float(ic_km)
-        ax.vlines(ik, y_up, y_up + 0.25, colors="black", zorder=8)
-        ax.text(
-            ik,
-            y_up + 0.32,
+        # 위/아래 수직선은 vlines 2회 대신 세그먼트 2개짜리 컬렉션 1개로
+        ic_segs = [[(ik, y_up), (ik, y_up + 0.25)], [(ik, y_down - 0.25), (ik, y_down)]]
+        ax.add_collection(LineCollection(ic_segs, colors="black", zorder=8))
+
+        # 라벨은 offset points 앵커로 — 데이터 좌표 재계산 없이 선 끝에 고정
+        ax.annotate(
             f"IC ({ik:.2f})",
+            xy=(ik, y_up + 0.25),
+            xytext=(0, 5),
+            textcoords="offset points",
             ha="center",
             fontsize=12,
             zorder=9,
             bbox=dict(boxstyle="round,pad=0.2", fc="white", ec="black", lw=1),
         )
-
-        ax.vlines(ik, y_down - 0.25, y_down, colors="black", zorder=8)
-        ax.text(
-            ik,
-            y_down - 0.32,
+        ax.annotate(
             f"IC ({ik:.2f})",
+            xy=(ik, y_down - 0.25),
+            xytext=(0, -5),
+            textcoords="offset points",
             ha="center",
             va="top",
             fontsize=12,
@@ -308,68 +419,130 @@ def draw_route(up_df, down_df, ic_km=None, group_threshold_km=0.03, fixed_points
         )
 
     ax.set_xlim(MIN_KM, MAX_KM)
-    ax.set_ylim(-1.0, 2.0)
+    ax.set_ylim(Y_MIN, Y_MAX)
     ax.axis("off")
-    fig.tight_layout()
     return fig
 
 
 # ======================================================
 # 8) 2페이지: 교량 목록(이름 표시)
 # ======================================================
-def draw_list_page(up_df, down_df):
-    fig, ax = plt.subplots(figsize=(16, 9))
+def draw_list_page(up, down):
+    # 고정 레이아웃(아래 주석 참조: tight_layout 패스 생략)
+    fig = plt.figure(figsize=(16, 9))
+    ax = fig.add_axes([0.02, 0.03, 0.96, 0.94])
     ax.axis("off")
 
     ax.text(0.05, 0.93, "영암 방향 교량 목록", fontsize=18, weight="bold")
     ax.text(0.55, 0.93, "순천 방향 교량 목록", fontsize=18, weight="bold")
 
-    def fmt_km(x):
-        return f"{float(x):.2f}k" if pd.notna(x) else "km 미상"
-
-    up_lines = []
-    for _, row in up_df.iterrows():
-        up_lines.append(f"{int(row['번호'])}. {row['표시이름']} — {fmt_km(row[KM_COL])}")
+    def build_lines(src):
+        # 줄 포맷도 행별 f-string 대신 np.char C 커널로 일괄 처리
+        kms = src.kms
+        nums_txt = src.nums.astype(str)
+        names_txt = src.names
+        km_txt = np.where(np.isnan(kms), "km 미상", np.char.mod("%.2fk", kms))
+        lines = np.char.add(
+            np.char.add(np.char.add(nums_txt, ". "), names_txt),
+            np.char.add(" — ", km_txt),
+        )
+        return "\n".join(lines.tolist())
 
-    down_lines = []
-    for _, row in down_df.iterrows():
-        down_lines.append(f"{int(row['번호'])}. {row['표시이름']} — {fmt_km(row[KM_COL])}")
+    up_text = build_lines(up)
+    down_text = build_lines(down)
 
-    ax.text(0.05, 0.86, "\n".join(up_lines) if up_lines else "선택된 교량 없음", fontsize=13, va="top")
-    ax.text(0.55, 0.86, "\n".join(down_lines) if down_lines else "선택된 교량 없음", fontsize=13, va="top")
+    ax.text(0.05, 0.86, up_text if up_text else "선택된 교량 없음", fontsize=13, va="top")
+    ax.text(0.55, 0.86, down_text if down_text else "선택된 교량 없음", fontsize=13, va="top")
 
-    fig.tight_layout()
     return fig
 
 
 # ======================================================
 # 9) PDF 생성/다운로드
+#    - 동일 선택으로 다시 누르면 그림/PDF 캐시를 그대로 재사용
 # ======================================================
-if st.button("노선도 생성 및 PDF 다운로드"):
+# 캐시에는 (미리보기 PNG, PDF) 바이트만 남기고 Figure는 저장 직후 닫는다
+# → pyplot 전역 레지스트리에 캔버스/Agg 버퍼가 rerun마다 쌓이는 누수 차단
+@st.cache_data(show_spinner=False)
+def build_outputs(sel_yeongam: tuple, sel_suncheon: tuple, threshold_km: float):
+    up_sorted, down_sorted = build_sorted_frames(list(sel_yeongam), list(sel_suncheon))
     fig_route = draw_route(
-        df_up_sorted,
-        df_down_sorted,
-        ic_km=ic_km,
-        group_threshold_km=group_threshold_km,
+        up_sorted,
+        down_sorted,
+        ic_km=load_data().ic_km,
+        group_threshold_km=threshold_km,
         fixed_points=FIXED_POINTS,
     )
-    fig_list = draw_list_page(df_up_sorted, df_down_sorted)
-
-    st.subheader("노선도 미리보기(1페이지)")
-    st.pyplot(fig_route)
-
-    pdf_buffer = BytesIO()
-    with PdfPages(pdf_buffer) as pdf:
-        pdf.savefig(fig_route, bbox_inches="tight")
-        pdf.savefig(fig_list, bbox_inches="tight")
-    pdf_buffer.seek(0)
-
-    st.download_button(
-        label="📄 PDF 다운로드 (노선도 + 교량목록)",
-        data=pdf_buffer,
-        file_name="노선도_및_교량목록.pdf",
-        mime="application/pdf",
-    )
+    fig_list = draw_list_page(up_sorted, down_sorted)
+
+    try:
+        # 미리보기는 st.pyplot 재렌더 대신 PNG 바이트로 1회 렌더 후 재사용
+        png_buffer = BytesIO()
+        fig_route.savefig(png_buffer, format="png", dpi=120)
+
+        # 레이아웃을 위에서 고정했으므로 bbox 재측정(bbox_inches="tight") 불필요
+        pdf_buffer = BytesIO()
+        # 고정 메타데이터 → 기본 CreationDate/ModDate 생성 생략 + 같은 입력이면 같은 바이트
+        with PdfPages(pdf_buffer, metadata={"Title": "노선도 및 교량목록", "Producer": ""}) as pdf:
+            # 래스터화된 마커 레이어가 선명하도록 PDF만 dpi를 올린다
+            pdf.savefig(fig_route, dpi=150)
+            pdf.savefig(fig_list, dpi=150)
+    finally:
+        # 예외 경로에서도 즉시 해제
+        plt.close(fig_route)
+        plt.close(fig_list)
+
+    return png_buffer.getvalue(), pdf_buffer.getvalue()
+
+
+# ======================================================
+# 10) UI — 얇은 디스패처(파생 상태는 전부 캐시 뒤)
+# ======================================================
+# fragment: 사이드바/버튼 조작이 모듈 전체 rerun 대신 이 블록만 재실행하게 격리
+@st.fragment
+def render_block():
+    bundle = load_data()
+
+    st.sidebar.header("교량 선택")
+    selected_yeongam = st.sidebar.multiselect("영암 방향 표시할 교량", bundle.yeongam_options)
+    selected_suncheon = st.sidebar.multiselect("순천 방향 표시할 교량", bundle.suncheon_options)
+
+    st.sidebar.divider()
+
+    # ✅ 가까운 교량 묶는 기준(0.01k대면 0.03~0.05 추천)
+    group_threshold_km = st.sidebar.number_input("가까운 교량 묶음 기준(km)", value=0.03, step=0.01)
+
+    # 캐시 키는 해시 가능한 튜플로
+    selection_key = (tuple(selected_yeongam), tuple(selected_suncheon), group_threshold_km)
+
+    if st.button("노선도 생성 및 PDF 다운로드"):
+        # 같은 키의 재클릭은 build_outputs 캐시 히트 → 바이트만 session_state에 유지
+        st.session_state["outputs_key"] = selection_key
+        st.session_state["outputs"] = build_outputs(*selection_key)
+
+    # 다운로드 클릭 등으로 rerun되어 버튼이 False여도 마지막 결과를 계속 표시
+    if st.session_state.get("outputs_key") == selection_key and "outputs" in st.session_state:
+        png_bytes, pdf_bytes = st.session_state["outputs"]
+
+        st.subheader("노선도 미리보기(1페이지)")
+        st.image(png_bytes, use_container_width=True)
+
+        st.download_button(
+            label="📄 PDF 다운로드 (노선도 + 교량목록)",
+            data=pdf_bytes,
+            file_name="노선도_및_교량목록.pdf",
+            mime="application/pdf",
+        )
+
+
+def main():
+    setup_korean_font()
+    st.title("거리비례 노선도 생성기")
+    render_block()
+
+
+if __name__ == "__main__":
+    main()
 
 
 